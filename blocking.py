@@ -0,0 +1,19 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import Executor
+from typing import Optional
+
+
+async def run_blocking(executor: Optional[Executor], function, *args, **kwargs):
+    """
+    Runs a blocking call (e.g. the synchronous OpenAI client or SQLite) in the
+    executor (the loop's default one if it's None), so it doesn't freeze the
+    event loop shared by all the bots. The context is copied, so the log
+    records keep the correlation ID.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        executor,
+        functools.partial(context.run, function, *args, **kwargs)
+    )
@@ -12,11 +12,23 @@ logger = logging.getLogger(__name__)
 
 class Configuration:
 
-    def get_settings(self) -> dynaconf.Dynaconf:
-        return self.settings
+    def get_settings(self, profile_name: str = None) -> dynaconf.Dynaconf:
+        if profile_name is None:
+            profile_name = self.get_profile_name()
+        return self.settings[profile_name]
 
     def get_profile_name(self) -> str:
-        return self.profile_name
+        return self.profile_names[0]
+
+    def get_profile_names(self) -> list[str]:
+        return list(self.profile_names)
+
+    @staticmethod
+    def load_settings(profile_name: str) -> dynaconf.Dynaconf:
+        return dynaconf.Dynaconf(
+            envvar_prefix="DOVBOBOT",
+            settings_files=[f'etc/{profile_name}.yaml', f'etc/.{profile_name}.secrets.yaml'],
+        )
 
     def __init__(self):
 
@@ -24,14 +36,16 @@ class Configuration:
         argument_parser.add_argument(
             "--profile",
             type=str,
+            nargs="+",
             required=False,
-            default="default",
-            help="The configuration profile to use"
+            default=["default"],
+            help="The configuration profile to use (several profiles can be given to run several bots at once)"
         )
         known_arguments, unknown_arguments = argument_parser.parse_known_args()
-        self.profile_name = known_arguments.profile
+        # Preserve the order, but don't let the same profile run twice
+        self.profile_names = list(dict.fromkeys(known_arguments.profile))
 
-        self.settings = dynaconf.Dynaconf(
-            envvar_prefix="DOVBOBOT",
-            settings_files=[f'etc/{self.profile_name}.yaml', f'etc/.{self.profile_name}.secrets.yaml'],
-        )
\ No newline at end of file
+        self.settings = {
+            profile_name: self.load_settings(profile_name)
+            for profile_name in self.profile_names
+        }
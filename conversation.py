@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from collections import deque
 from enum import StrEnum
@@ -51,6 +52,9 @@ class Conversation:
     def clear_active_run(self):
         self.set_active_run(None)
 
+    def get_lock(self) -> asyncio.Lock:
+        return self.lock
+
     def get_history(self) -> list:
         return list(self.conversation_history)
 
@@ -78,3 +82,6 @@ class Conversation:
         self.history_size = history_size
         self.conversation_history = deque(maxlen=history_size)
         self.active_run = None
+        # Serializes the runs and the thread resets, only one of them can use
+        # the thread at a time
+        self.lock = asyncio.Lock()
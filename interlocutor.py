@@ -2,6 +2,7 @@ import asyncio.tasks
 import json
 import logging
 import time
+from concurrent.futures import Executor
 from enum import StrEnum
 from threading import activeCount
 
@@ -13,7 +14,9 @@ import openai
 from typing_extensions import Optional
 
 from config import PROJECT_NAME
+import blocking
 import conversation
+import logging_pipeline
 
 
 DEFAULT_HISTORY_SIZE = 100
@@ -63,18 +66,21 @@ def chat_event_handler(function):
             if (chat_id := kwargs.get('chat_id')) is None:
                 raise ValueError("The 'chat_id' parameter is required for all chat event handlers")
             # Try to find the related Conversation object or create a new one.
-            if self.get_conversation(chat_id) is None:
-                # Seems to be a new chat, let's create a new Conversation object.
-                logger.debug(f'Creating a new conversation for chat {chat_id}')
-                # Create a new thread.
-                thread = self.create_thread()
-                self.add_conversation(
-                    chat_id=chat_id,
-                    conversation=conversation.Conversation(
-                        thread=thread,
-                        history_size=DEFAULT_HISTORY_SIZE
+            # Creating the thread is awaited, so the chat is locked meanwhile,
+            # otherwise another update of the same chat would create one more.
+            async with self.get_chat_lock(chat_id):
+                if self.get_conversation(chat_id) is None:
+                    # Seems to be a new chat, let's create a new Conversation object.
+                    logger.debug('Creating a new conversation for chat %s', chat_id)
+                    # Create a new thread.
+                    thread = await self.create_thread()
+                    self.add_conversation(
+                        chat_id=chat_id,
+                        conversation=conversation.Conversation(
+                            thread=thread,
+                            history_size=DEFAULT_HISTORY_SIZE
+                        )
                     )
-                )
             kwargs['conversation'] = self.get_conversation(chat_id)
         return await function(self, *args, **kwargs)
     return wrapper
@@ -122,14 +128,22 @@ class Interlocutor:
     def get_conversation(self, chat_id: int) -> conversation.Conversation:
         return self.conversations.get(chat_id)
 
-    def reset_conversation(self, chat_id: int):
+    def get_chat_lock(self, chat_id: int) -> asyncio.Lock:
+        return self.chat_locks.setdefault(chat_id, asyncio.Lock())
+
+    async def run_blocking(self, function, *args, **kwargs):
+        return await blocking.run_blocking(self.executor, function, *args, **kwargs)
+
+    async def reset_conversation(self, chat_id: int):
         conversation = self.get_conversation(chat_id)
-        thread_id = conversation.get_thread_id()
-        self.openai.beta.threads.delete(thread_id)
-        conversation.set_thread(self.create_thread())
+        # Don't let any run use the thread while it's being replaced
+        async with conversation.get_lock():
+            thread_id = conversation.get_thread_id()
+            await self.run_blocking(self.openai.beta.threads.delete, thread_id)
+            conversation.set_thread(await self.create_thread())
 
-    def create_thread(self) -> Thread:
-        return self.openai.beta.threads.create()
+    async def create_thread(self) -> Thread:
+        return await self.run_blocking(self.openai.beta.threads.create)
 
     async def call_openai(
             self,
@@ -137,33 +151,52 @@ class Interlocutor:
             prompt: Optional[str] = None
     ):
         logger.debug('Prompt: %s', prompt)
-        while conversation.has_active_run():
+        if conversation.get_lock().locked():
             logger.debug('Waiting for the previous run to finish')
-            await asyncio.sleep(0.5)
-        request = self.openai.beta.threads.messages.create(
-            thread_id=conversation.get_thread_id(),
-            role="user",
-            content=prompt
-        )
-        run = self.openai.beta.threads.runs.create(
-            thread_id=conversation.get_thread_id(),
-            assistant_id=self.assistant_id,
-        )
-        conversation.set_active_run(run)
-        while run.status == "queued" or run.status == "in_progress":
-            logger.debug('Run status: %s', run.status)
-            run = self.openai.beta.threads.runs.retrieve(
-                thread_id=conversation.get_thread_id(),
-                run_id=run.id,
+        # The OpenAI calls are awaited, so another message of the same chat could
+        # start its own run in between, and a thread can't have two active runs
+        async with conversation.get_lock():
+            thread_id = conversation.get_thread_id()
+            request = await self.run_blocking(
+                self.openai.beta.threads.messages.create,
+                thread_id=thread_id,
+                role="user",
+                content=prompt
+            )
+            run = await self.run_blocking(
+                self.openai.beta.threads.runs.create,
+                thread_id=thread_id,
+                assistant_id=self.assistant_id,
+            )
+            conversation.set_active_run(run)
+            logging_pipeline.set_correlation(run_id=run.id)
+            try:
+                while run.status == "queued" or run.status == "in_progress":
+                    logger.debug(
+                        'Run status: %s',
+                        run.status,
+                        extra={logging_pipeline.SAMPLE_KEY_ATTRIBUTE: f'run-status-{run.id}'}
+                    )
+                    run = await self.run_blocking(
+                        self.openai.beta.threads.runs.retrieve,
+                        thread_id=thread_id,
+                        run_id=run.id,
+                    )
+                    await asyncio.sleep(0.5)
+            finally:
+                conversation.clear_active_run()
+            logger.debug('Run finished with status: %s', run.status)
+            # Iterating the page fetches the next ones, so it's done in the executor too
+            messages = await self.run_blocking(
+                lambda: list(
+                    self.openai.beta.threads.messages.list(
+                        thread_id=thread_id,
+                        run_id=run.id,
+                        after=request.id,
+                        order="asc",
+                    )
+                )
             )
-            await asyncio.sleep(0.5)
-        conversation.clear_active_run()
-        messages = self.openai.beta.threads.messages.list(
-            thread_id=conversation.get_thread_id(),
-            run_id=run.id,
-            after=request.id,
-            order="asc",
-        )
         responses = []
         for message in messages:
             if message.role == "assistant" and message.content is not None:
@@ -277,13 +310,22 @@ class Interlocutor:
             openai_api_key: str,
             assistant_id: str,
             conversations: dict,
-            common_phrases: dict[CommonPhrase, str]
+            common_phrases: dict[CommonPhrase, str],
+            openai_client: Optional[openai.OpenAI] = None,
+            executor: Optional[Executor] = None
     ) -> None:
         self.openai_token = openai_api_key
         self.assistant_id = assistant_id
         self.common_phrases = common_phrases
         self.conversations = conversations
-        # Initialize OpenAI objects
-        self.openai = openai.OpenAI(api_key=self.openai_token)
+        self.chat_locks: dict[int, asyncio.Lock] = {}
+        # Initialize OpenAI objects (the client may be shared with other bots
+        # running in the same process, so we reuse it when it's given)
+        if openai_client is None:
+            openai_client = openai.OpenAI(api_key=self.openai_token)
+        self.openai = openai_client
+        # The executor running the blocking OpenAI calls (the loop's default
+        # one is used if it isn't given)
+        self.executor = executor
         self.assistant = self.openai.beta.assistants.retrieve(assistant_id)
         self.thread = None
\ No newline at end of file
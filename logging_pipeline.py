@@ -0,0 +1,115 @@
+import contextvars
+import logging
+import threading
+import time
+from typing import Optional
+
+
+# The records having this attribute (pass it with 'extra') are sampled: only
+# one record per key is let through during the sampling interval.
+SAMPLE_KEY_ATTRIBUTE = 'sample_key'
+
+# Don't let the sampling filter remember too many keys
+MAX_SAMPLE_KEYS = 1024
+
+
+# The correlation ID of the request being handled, it's a dict with the 'bot',
+# 'chat_id', 'update_id' and 'run_id' keys (some of them may be missing). The
+# bot (profile) name tells apart the bots running in the same process, as each
+# of them has its own sequence of update IDs.
+# As asyncio tasks copy the context when they're created, setting it before
+# creating a task makes all the records logged by the task carry it.
+correlation: contextvars.ContextVar[dict] = contextvars.ContextVar('correlation', default={})
+
+
+def set_correlation(
+        bot: Optional[str] = None,
+        chat_id: Optional[int] = None,
+        update_id: Optional[int] = None,
+        run_id: Optional[str] = None
+) -> None:
+    """Adds the given identifiers to the correlation ID of the current context."""
+    updated_correlation = dict(correlation.get())
+    for key, value in (('bot', bot), ('chat_id', chat_id), ('update_id', update_id), ('run_id', run_id)):
+        if value is not None:
+            updated_correlation[key] = value
+    correlation.set(updated_correlation)
+
+
+def reset_correlation(
+        bot: Optional[str] = None,
+        chat_id: Optional[int] = None,
+        update_id: Optional[int] = None
+) -> None:
+    """Starts a new correlation ID in the current context."""
+    correlation.set({})
+    set_correlation(bot=bot, chat_id=chat_id, update_id=update_id)
+
+
+class CorrelationFilter(logging.Filter):
+    """
+    Adds the correlation ID to the records, both as separate attributes
+    ('bot', 'chat_id', 'update_id', 'run_id') and as the 'correlation_id'
+    string that can be used in the logging format.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        current_correlation = correlation.get()
+        record.bot = current_correlation.get('bot')
+        record.chat_id = current_correlation.get('chat_id')
+        record.update_id = current_correlation.get('update_id')
+        record.run_id = current_correlation.get('run_id')
+        record.correlation_id = '/'.join(
+            str(value)
+            for value in (record.bot, record.chat_id, record.update_id, record.run_id)
+            if value is not None
+        ) or '-'
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through only one record per sample key during the sampling interval
+    and tells how many similar records have been suppressed since the last
+    one. The records without the sample key aren't affected.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if (sample_key := getattr(record, SAMPLE_KEY_ATTRIBUTE, None)) is None:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            last_time, suppressed = self.samples.get(sample_key, (None, 0))
+            if last_time is not None and now - last_time < self.interval:
+                self.samples[sample_key] = (last_time, suppressed + 1)
+                return False
+            if len(self.samples) >= MAX_SAMPLE_KEYS:
+                self.samples = {
+                    key: sample for key, sample in self.samples.items() if now - sample[0] < self.interval
+                }
+            self.samples[sample_key] = (now, 0)
+        if suppressed > 0:
+            record.msg = f'{record.getMessage()} ({suppressed} similar messages suppressed)'
+            record.args = None
+        return True
+
+    def __init__(self, interval: float) -> None:
+        super().__init__()
+        self.interval = interval
+        self.samples: dict[str, tuple[float, int]] = {}
+        self.lock = threading.Lock()
+
+
+class TruncatingFilter(logging.Filter):
+    """Truncates the messages longer than the given length."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        if len(message) > self.max_length:
+            record.msg = f'{message[:self.max_length]}... ({len(message) - self.max_length} more characters)'
+            record.args = None
+        return True
+
+    def __init__(self, max_length: int) -> None:
+        super().__init__()
+        self.max_length = max_length
@@ -1,13 +1,48 @@
 #!/usr/bin/env python
 
+import asyncio
+import atexit
 import logging
+import logging.handlers
+import queue
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import openai
+from telegram.request import HTTPXRequest
 
 import config
 import interlocutor
+import logging_pipeline
+import stall_detector
 import telegram_client
+import update_store
+
+
+# The connection pool of the Telegram requests shared by all the bots
+TELEGRAM_CONNECTION_POOL_SIZE = 256
+
+# The threads running the blocking calls (OpenAI, SQLite) of all the bots
+THREAD_POOL_SIZE = 32
+
+
+logger = logging.getLogger(f'{config.PROJECT_NAME}.{__name__}')
 
 
-def setup_logging(logging_level: int, logging_format: str) -> None:
+def setup_logging(
+        logging_level: int,
+        logging_format: str,
+        sample_interval: float,
+        max_message_length: int
+) -> logging.handlers.QueueListener:
+    """
+    Sets up the non-blocking logging pipeline: the records are filtered,
+    sampled and truncated in the thread that logs them, then they're put to a
+    queue and written by the listener's thread, so the event loop never waits
+    for the output. Returns the listener, it should be stopped at exit to
+    flush the queue.
+    """
 
     class ModuleFilter(logging.Filter):
         def filter(self, record: logging.LogRecord) -> bool:
@@ -20,37 +55,148 @@ def setup_logging(logging_level: int, logging_format: str) -> None:
     handler.setLevel(logging_level)
     handler.setFormatter(logging.Formatter(logging_format))
 
-    handler.addFilter(ModuleFilter())
-    logger.addHandler(handler)
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.setLevel(logging_level)
+    queue_handler.addFilter(ModuleFilter())
+    queue_handler.addFilter(logging_pipeline.CorrelationFilter())
+    queue_handler.addFilter(logging_pipeline.SamplingFilter(interval=sample_interval))
+    queue_handler.addFilter(logging_pipeline.TruncatingFilter(max_length=max_message_length))
+    logger.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+async def run_telegram_clients(
+        telegram_clients: list[telegram_client.TelegramClient],
+        telegram_request: HTTPXRequest,
+        my_stall_detector: Optional[stall_detector.StallDetector] = None
+) -> None:
+    """
+    Runs several bots on the same event loop until the process is interrupted
+    or terminated, the stall detector (if given) watches the loop meanwhile. The request
+    shared by the bots is shut down after all of them have stopped.
+    """
+    # Stop on the same signals run_polling() does
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        try:
+            loop.add_signal_handler(stop_signal, stop_event.set)
+        except NotImplementedError:
+            # Windows doesn't support signal handlers in asyncio, Ctrl-C still
+            # raises KeyboardInterrupt there
+            pass
+    # A bot is stopped even if its start() has failed halfway
+    touched_telegram_clients = []
+    if my_stall_detector is not None:
+        await my_stall_detector.start()
+    try:
+        for my_telegram_client in telegram_clients:
+            touched_telegram_clients.append(my_telegram_client)
+            await my_telegram_client.start()
+        await stop_event.wait()
+        logger.info("Stopping the bots")
+    finally:
+        for my_telegram_client in reversed(touched_telegram_clients):
+            try:
+                await my_telegram_client.stop()
+            except Exception as error:
+                logger.error("Can't stop the bot properly: %s", error)
+        await telegram_request.shutdown()
+        if my_stall_detector is not None:
+            await my_stall_detector.stop()
 
 def main() -> None:
 
     configuration = config.Configuration()
     configuration_settings = configuration.get_settings()
-    configuration_profile = configuration.get_profile_name()
+    configuration_profiles = configuration.get_profile_names()
 
-    setup_logging(
+    # Logging is set up once per process, so the first profile's settings are used
+    logging_listener = setup_logging(
         logging_level=configuration_settings.logging.level,
-        logging_format=configuration_settings.logging.format
-    )
-    logger = logging.getLogger(f'{config.PROJECT_NAME}.{__name__}')
-
-    logger.debug(f"Chosen profile: {configuration_profile}")
-    logger.debug(f"Loaded settings: {configuration_settings}")
-
-    my_conversations = {}
-
-    my_interlocutor = interlocutor.Interlocutor(
-        openai_api_key=configuration_settings.openai.api_key,
-        assistant_id=configuration_settings.openai.assistant_id,
-        common_phrases=configuration_settings.interlocutor.common_phrases,
-        conversations=my_conversations
-    )
-
-    my_telegram_client = telegram_client.TelegramClient(
-        telegram_token=configuration_settings.telegram.token,
-        interlocutor=my_interlocutor,
+        logging_format=configuration_settings.logging.format,
+        sample_interval=configuration_settings.logging.sample_interval,
+        max_message_length=configuration_settings.logging.max_message_length
     )
+    atexit.register(logging_listener.stop)
+
+    logger.debug("Chosen profiles: %s", configuration_profiles)
+
+    # These resources are shared by all the bots running in this process
+    openai_http_client = openai.DefaultHttpxClient()
+    openai_clients: dict[str, openai.OpenAI] = {}
+    executor = ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE, thread_name_prefix='Blocking')
+    telegram_request = HTTPXRequest(connection_pool_size=TELEGRAM_CONNECTION_POOL_SIZE)
+
+    my_telegram_clients = []
+
+    for configuration_profile in configuration_profiles:
+
+        profile_settings = configuration.get_settings(configuration_profile)
+        # Don't dump the settings, they're large and contain the secrets
+        logger.debug("Loaded settings of %s", configuration_profile)
+
+        # The bots using the same API key use the same OpenAI client
+        openai_api_key = profile_settings.openai.api_key
+        if openai_api_key not in openai_clients:
+            openai_clients[openai_api_key] = openai.OpenAI(
+                api_key=openai_api_key,
+                http_client=openai_http_client
+            )
+
+        # Each bot has its own conversations, they are never shared
+        my_conversations = {}
+
+        my_interlocutor = interlocutor.Interlocutor(
+            openai_api_key=openai_api_key,
+            assistant_id=profile_settings.openai.assistant_id,
+            common_phrases=profile_settings.interlocutor.common_phrases,
+            conversations=my_conversations,
+            openai_client=openai_clients[openai_api_key],
+            executor=executor
+        )
+
+        my_update_store = update_store.UpdateStore(
+            path=profile_settings.update_store.path
+        )
+
+        my_telegram_clients.append(
+            telegram_client.TelegramClient(
+                telegram_token=profile_settings.telegram.token,
+                interlocutor=my_interlocutor,
+                update_store=my_update_store,
+                # A single bot owns the request, several bots only share it
+                request=(
+                    telegram_request if len(configuration_profiles) == 1
+                    else telegram_client.SharedRequest(telegram_request)
+                ),
+                executor=executor,
+                name=configuration_profile,
+            )
+        )
+
+    # The stall detector watches the whole event loop, so it's configured by
+    # the first profile's settings, just like logging
+    my_stall_detector = None
+    if configuration_settings.stall_detector.enabled:
+        my_stall_detector = stall_detector.StallDetector(
+            threshold=configuration_settings.stall_detector.threshold,
+            interval=configuration_settings.stall_detector.interval,
+            report_interval=configuration_settings.stall_detector.report_interval
+        )
+
+    try:
+        if len(my_telegram_clients) == 1 and my_stall_detector is None:
+            my_telegram_clients[0].run()
+        else:
+            try:
+                asyncio.run(run_telegram_clients(my_telegram_clients, telegram_request, my_stall_detector))
+            except KeyboardInterrupt:
+                logger.info("Stopped by the user")
+    finally:
+        executor.shutdown(cancel_futures=True)
 
 if __name__ == "__main__":
     main()
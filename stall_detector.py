@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from config import PROJECT_NAME
+
+
+# How many innermost frames of the blocking call's stack are logged
+STACK_DEPTH = 10
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+logger = logging.getLogger(f'{PROJECT_NAME}.{__name__}')
+
+
+class Offender:
+
+    def get_location(self) -> str:
+        return self.location
+
+    def get_stack(self) -> str:
+        return self.stack
+
+    def get_count(self) -> int:
+        return self.count
+
+    def get_total_lag(self) -> float:
+        return self.total_lag
+
+    def get_max_lag(self) -> float:
+        return self.max_lag
+
+    def add_stall(self, lag: float) -> None:
+        self.count += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+
+    def __init__(self, location: str, stack: str) -> None:
+        self.location = location
+        self.stack = stack
+        self.count = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+
+
+class StallDetector:
+    """
+    Watchdog that finds the calls blocking the event loop.
+
+    A heartbeat task running on the loop measures how late it's woken up (the
+    event loop lag). A separate thread watches the heartbeat and, when the
+    loop hasn't been responding for longer than the threshold, captures the
+    stack of the loop's thread, i.e. the stack of the coroutine or callback
+    that is blocking it. The stalls are aggregated by the location of the
+    blocking call (the innermost frame belonging to the project) and reported
+    to the log periodically, along with a line of statistics with fixed keys.
+    """
+
+    @staticmethod
+    def find_location(stack: traceback.StackSummary) -> str:
+        # The innermost frame of our own code is the most useful one, the
+        # frames of the libraries only tell what the blocking call was
+        for frame in reversed(stack):
+            filename = os.path.abspath(frame.filename)
+            if (
+                    filename.startswith(PROJECT_DIRECTORY)
+                    and 'site-packages' not in filename
+                    and filename != os.path.abspath(__file__)
+            ):
+                return f'{os.path.relpath(frame.filename, PROJECT_DIRECTORY)}:{frame.lineno} in {frame.name}'
+        frame = stack[-1]
+        return f'{frame.filename}:{frame.lineno} in {frame.name}'
+
+    @staticmethod
+    def is_idle(stack: traceback.StackSummary) -> bool:
+        # If the loop is waiting for the events or is between the callbacks,
+        # the blocking call has just returned and the heartbeat hasn't run yet,
+        # so there's nothing to blame
+        frame = stack[-1]
+        return (
+            os.path.basename(frame.filename) == 'selectors.py'
+            or (os.path.basename(frame.filename) == 'base_events.py' and frame.name == '_run_once')
+        )
+
+    def get_offenders(self) -> list[Offender]:
+        with self.lock:
+            return sorted(self.offenders.values(), key=lambda offender: offender.get_total_lag(), reverse=True)
+
+    def get_statistics(self) -> dict:
+        with self.lock:
+            return {
+                'stalls': self.stalls,
+                'max_lag': self.max_lag,
+                'last_lag': self.last_lag,
+                'offenders': len(self.offenders),
+            }
+
+    def capture_stall(self) -> None:
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        if self.is_idle(stack):
+            return
+        location = self.find_location(stack)
+        with self.lock:
+            if (offender := self.offenders.get(location)) is None:
+                offender = self.offenders[location] = Offender(
+                    location,
+                    ''.join(traceback.StackSummary.from_list(stack[-STACK_DEPTH:]).format())
+                )
+                first_seen = True
+            else:
+                first_seen = False
+            self.stalled_by = offender
+        if first_seen:
+            logger.warning(
+                'The event loop is blocked for more than %.3fs at %s:\n%s',
+                self.threshold,
+                location,
+                offender.get_stack()
+            )
+
+    def record_lag(self, lag: float) -> None:
+        with self.lock:
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            if lag < self.threshold:
+                self.stalled_by = None
+                return
+            self.stalls += 1
+            offender, self.stalled_by = self.stalled_by, None
+            if offender is not None:
+                offender.add_stall(lag)
+        logger.debug(
+            'The event loop has been stalled for %.3fs by %s',
+            lag,
+            offender.get_location() if offender is not None else 'an unknown call'
+        )
+
+    def report(self) -> None:
+        statistics = self.get_statistics()
+        # This line is always logged and its keys never change, so the load
+        # tests can parse it (the same values come as the record's attributes)
+        logger.info(
+            'Event loop statistics: stalls=%d max_lag=%.3f last_lag=%.3f offenders=%d',
+            statistics['stalls'],
+            statistics['max_lag'],
+            statistics['last_lag'],
+            statistics['offenders'],
+            extra={'stall_statistics': statistics}
+        )
+        offenders = self.get_offenders()
+        if len(offenders) == 0:
+            return
+        logger.info(
+            'Event loop stalls: %d, max lag: %.3fs, offenders:\n%s',
+            statistics['stalls'],
+            statistics['max_lag'],
+            '\n'.join(
+                f'  {offender.get_location()}: {offender.get_count()} stalls, '
+                f'{offender.get_total_lag():.3f}s total, {offender.get_max_lag():.3f}s max'
+                for offender in offenders
+            )
+        )
+
+    async def heartbeat(self) -> None:
+        last_report = time.monotonic()
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.last_beat = now
+            self.record_lag(now - before - self.interval)
+            if now - last_report >= self.report_interval:
+                self.report()
+                last_report = now
+
+    def watch(self) -> None:
+        while not self.stopping.wait(self.interval):
+            with self.lock:
+                already_captured = self.stalled_by is not None
+            if not already_captured and time.monotonic() - self.last_beat > self.interval + self.threshold:
+                self.capture_stall()
+
+    async def start(self) -> None:
+        """Starts watching the running event loop."""
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.stopping.clear()
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
+        self.watcher_thread = threading.Thread(target=self.watch, name='StallDetector', daemon=True)
+        self.watcher_thread.start()
+        logger.info('Stall detector started, the threshold is %.3fs', self.threshold)
+
+    async def stop(self) -> None:
+        self.stopping.set()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            try:
+                await self.heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self.heartbeat_task = None
+        if self.watcher_thread is not None:
+            self.watcher_thread.join()
+            self.watcher_thread = None
+        self.report()
+
+    def __init__(
+            self,
+            threshold: float,
+            interval: float,
+            report_interval: float
+    ) -> None:
+        self.threshold = threshold
+        self.interval = interval
+        self.report_interval = report_interval
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.offenders: dict[str, Offender] = {}
+        self.stalled_by: Optional[Offender] = None
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.last_beat = time.monotonic()
+        self.loop_thread_id: Optional[int] = None
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        self.watcher_thread: Optional[threading.Thread] = None
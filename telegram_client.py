@@ -5,24 +5,74 @@ import asyncio
 import json
 import logging
 from asyncio import Task
+from concurrent.futures import Executor
 from typing import Optional, Coroutine, Any
 
 from telegram import Chat, ChatMember, ChatMemberUpdated, Update
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, ChatMigrated, Forbidden, TelegramError
+from telegram.request import BaseRequest, RequestData
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
     ChatMemberHandler,
     ContextTypes,
     MessageHandler,
+    TypeHandler,
     filters,
 )
 
+import blocking
 from interlocutor import Interlocutor
+from logging_pipeline import reset_correlation
+from update_store import PendingReply, UpdateStore
 from config import PROJECT_NAME
 
 logger = logging.getLogger(f'{PROJECT_NAME}.{__name__}')
 
 
+class SharedRequest(BaseRequest):
+    """
+    Wraps a request object shared by several bots. A bot shuts its request
+    down when it stops, but the shared one must stay open until the last bot
+    has stopped, so shutting the wrapper down does nothing and it's up to the
+    owner of the shared request to shut it down.
+    """
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.request.read_timeout
+
+    async def initialize(self) -> None:
+        await self.request.initialize()
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(
+            self,
+            url: str,
+            method: str,
+            request_data: Optional[RequestData] = None,
+            read_timeout: Any = BaseRequest.DEFAULT_NONE,
+            write_timeout: Any = BaseRequest.DEFAULT_NONE,
+            connect_timeout: Any = BaseRequest.DEFAULT_NONE,
+            pool_timeout: Any = BaseRequest.DEFAULT_NONE,
+    ) -> tuple[int, bytes]:
+        return await self.request.do_request(
+            url=url,
+            method=method,
+            request_data=request_data,
+            read_timeout=read_timeout,
+            write_timeout=write_timeout,
+            connect_timeout=connect_timeout,
+            pool_timeout=pool_timeout,
+        )
+
+    def __init__(self, request: BaseRequest) -> None:
+        self.request = request
+
+
 class TelegramClient:
 
     @staticmethod
@@ -51,36 +101,116 @@ class TelegramClient:
 
         return was_member, is_member
 
-    async def process_responses(
-            self,
-            update: Update,
-            responses: list,
-            reply_to_message: Optional[int] = None
-    ) -> None:
-        for response in responses:
-            response = json.loads(response)
+    async def skip_processed_updates(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Stops redelivered updates that have already been answered before
+        they reach the interlocutor.
+        """
+        # This handler sees every update first, so it's the right place to
+        # start the correlation ID of the records related to the update
+        reset_correlation(
+            bot=self.name,
+            chat_id=update.effective_chat.id if update.effective_chat is not None else None,
+            update_id=update.update_id
+        )
+        if await self.run_blocking(self.update_store.is_processed, update.update_id):
+            logger.info("Skipping update %s, it has already been processed", update.update_id)
+            raise ApplicationHandlerStop
+
+    async def resume_pending_replies(self, application: Application) -> None:
+        """Sends the replies that were generated but not delivered before the
+        bot had been stopped.
+        """
+        for pending_reply in await self.run_blocking(self.update_store.get_pending_replies):
+            reset_correlation(
+                bot=self.name,
+                chat_id=pending_reply.get_chat_id(),
+                update_id=pending_reply.get_update_id()
+            )
+            logger.info(
+                "Resuming %d undelivered replies to update %s in chat %s",
+                len(pending_reply.get_undelivered_responses()),
+                pending_reply.get_update_id(),
+                pending_reply.get_chat_id()
+            )
+            try:
+                await self.deliver_responses(pending_reply)
+            except (Forbidden, BadRequest, ChatMigrated) as error:
+                # The reply would fail the same way on every restart (e.g. the
+                # user has blocked the bot), so it's dropped instead of keeping
+                # the bot from starting
+                logger.error(
+                    "Can't resume the replies to update %s in chat %s, dropping them: %s",
+                    pending_reply.get_update_id(),
+                    pending_reply.get_chat_id(),
+                    error
+                )
+                await self.run_blocking(self.update_store.remove_pending_reply, pending_reply)
+            except TelegramError as error:
+                # Network errors, timeouts and flood control are transient, so
+                # the reply is kept to be resumed on the next start
+                logger.warning(
+                    "Can't resume the replies to update %s in chat %s, keeping them for the next start: %s",
+                    pending_reply.get_update_id(),
+                    pending_reply.get_chat_id(),
+                    error
+                )
+
+    async def deliver_responses(self, pending_reply: PendingReply) -> None:
+        chat_id = pending_reply.get_chat_id()
+        reply_to_message = pending_reply.get_reply_to_message()
+        responses = pending_reply.get_responses()
+        for index in range(pending_reply.get_delivered(), len(responses)):
+            response = json.loads(responses[index])
             if response.get('type') == 'noop':
+                await self.run_blocking(self.update_store.set_delivered, pending_reply, index + 1)
                 continue
             message_parameters: dict = {
+                'chat_id': chat_id,
                 'text': response.get('content', {}).get('message', 'Не знаю, що й сказати.'),
                 'parse_mode': ParseMode.HTML
             }
             if reply_to_message is not None:
-                message_parameters.update({'reply_to_message_id': reply_to_message})
+                message_parameters.update({
+                    'reply_to_message_id': reply_to_message,
+                    # The message may have been deleted while we were thinking
+                    'allow_sending_without_reply': True
+                })
             message_parameters.update({
                 'text':
-                    f'{message_parameters['text']}\n\n'
-                    f'DEBUG INFO: <i>{response.get('content', {}).get('debug')}</i>'
+                    f'{message_parameters["text"]}\n\n'
+                    f'DEBUG INFO: <i>{response.get("content", {}).get("debug")}</i>'
             })
-            await update.effective_chat.send_message(**message_parameters)
+            await self.application.bot.send_message(**message_parameters)
             if (winner := response.get('content', {}).get('winner')) is not None:
                 logger.debug("The winner is %s", winner)
-                await update.effective_chat.send_message(
+                await self.application.bot.send_message(
+                    chat_id=chat_id,
                     text=f"Виграв <b>{winner}</b>!",
                     parse_mode=ParseMode.HTML
                 )
-                chat_id = update.effective_chat.id
-                thread_id = self.interlocutor.reset_conversation(chat_id)
+                # The conversation may be gone if the bot has been restarted
+                # since the reply was generated.
+                if self.interlocutor.get_conversation(chat_id) is not None:
+                    await self.interlocutor.reset_conversation(chat_id)
+            await self.run_blocking(self.update_store.set_delivered, pending_reply, index + 1)
+        await self.run_blocking(self.update_store.remove_pending_reply, pending_reply)
+
+    async def process_responses(
+            self,
+            update: Update,
+            responses: list,
+            reply_to_message: Optional[int] = None
+    ) -> None:
+        # Persist the responses before sending anything, so they can be
+        # resumed after a crash instead of asking the assistant once again.
+        pending_reply = await self.run_blocking(
+            self.update_store.add_pending_reply,
+            update_id=update.update_id,
+            chat_id=update.effective_chat.id,
+            responses=responses,
+            reply_to_message=reply_to_message
+        )
+        await self.deliver_responses(pending_reply)
 
     async def track_chats(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         chat = update.effective_chat
@@ -212,17 +342,76 @@ class TelegramClient:
                     )
             )
 
+    async def run_blocking(self, function, *args, **kwargs):
+        return await blocking.run_blocking(self.executor, function, *args, **kwargs)
+
+    async def close_update_store(self, application: Application) -> None:
+        await self.run_blocking(self.update_store.close)
+
+    def run(self) -> None:
+        """Run the bot until the user presses Ctrl-C."""
+        # We pass 'allowed_updates' handle *all* updates including `chat_member` updates
+        # To reset this, simply pass `allowed_updates=[]`
+        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+    async def start(self) -> None:
+        """Start the bot on the running event loop without blocking it, so
+        several bots can share the same loop. Don't forget to call stop().
+        """
+        await self.application.initialize()
+        # The post_init callback is called by run_polling() only
+        await self.resume_pending_replies(self.application)
+        await self.application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        await self.application.start()
+
+    async def stop(self) -> None:
+        if self.application.updater.running:
+            await self.application.updater.stop()
+        if self.application.running:
+            await self.application.stop()
+        await self.application.shutdown()
+        # The post_shutdown callback is called by run_polling() only
+        await self.close_update_store(self.application)
+
     def __init__(
             self,
             telegram_token: str,
-            interlocutor: Interlocutor
+            interlocutor: Interlocutor,
+            update_store: UpdateStore,
+            request: Optional[BaseRequest] = None,
+            executor: Optional[Executor] = None,
+            name: Optional[str] = None
     ) -> None:
-        """Start the bot."""
+        """Set up the bot, call run() or start() to actually start it."""
         # Set the interlocutor
         self.interlocutor = interlocutor
 
+        # Set the store of processed updates and undelivered replies
+        self.update_store = update_store
+
+        # Set the executor running the blocking calls (the store's ones)
+        self.executor = executor
+
+        # Set the name (the profile name) telling this bot's log records apart
+        # from the other bots' ones
+        self.name = name
+
         # Create the Application and pass it your bot's token.
-        application = Application.builder().token(telegram_token).build()
+        application_builder = (
+            Application.builder()
+            .token(telegram_token)
+            .post_init(self.resume_pending_replies)
+            .post_shutdown(self.close_update_store)
+        )
+        # The request object (and its connection pool) may be shared with other
+        # bots running in the same process, wrap it with SharedRequest then
+        if request is not None:
+            application_builder = application_builder.request(request)
+        application = application_builder.build()
+        self.application = application
+
+        # Drop the redelivered updates before any other handler sees them
+        application.add_handler(TypeHandler(Update, self.skip_processed_updates), group=-1)
 
         # Keep track of which chats the bot is in
         application.add_handler(ChatMemberHandler(self.track_chats, ChatMemberHandler.MY_CHAT_MEMBER))
@@ -233,8 +422,3 @@ class TelegramClient:
 
         # Handle the messages
         application.add_handler(MessageHandler(filters.CHAT, self.handle_chat_message))
-
-        # Run the bot until the user presses Ctrl-C
-        # We pass 'allowed_updates' handle *all* updates including `chat_member` updates
-        # To reset this, simply pass `allowed_updates=[]`
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,151 @@
+import asyncio
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import interlocutor
+
+
+class FakeOpenAI:
+    """
+    Mimics the synchronous OpenAI client: every call blocks for a while, and a
+    thread can't have two active runs, just like in the real API.
+    """
+
+    def create_thread(self):
+        time.sleep(0.01)
+        thread = SimpleNamespace(id=f'thread_{next(self.ids)}')
+        with self.lock:
+            self.threads.add(thread.id)
+        return thread
+
+    def delete_thread(self, thread_id):
+        with self.lock:
+            self.threads.remove(thread_id)
+        time.sleep(0.01)
+
+    def create_message(self, thread_id, role, content):
+        time.sleep(0.01)
+        assert thread_id in self.threads
+        return SimpleNamespace(id=f'message_{next(self.ids)}')
+
+    def create_run(self, thread_id, assistant_id):
+        time.sleep(0.01)
+        with self.lock:
+            if thread_id in self.active_runs:
+                raise RuntimeError(f'Thread {thread_id} already has an active run')
+            run = SimpleNamespace(id=f'run_{next(self.ids)}', status='queued', thread_id=thread_id)
+            self.active_runs[thread_id] = run
+        return run
+
+    def retrieve_run(self, thread_id, run_id):
+        time.sleep(0.01)
+        assert thread_id in self.threads
+        with self.lock:
+            run = self.active_runs.pop(thread_id)
+        return SimpleNamespace(id=run.id, status='completed', thread_id=thread_id)
+
+    def list_messages(self, thread_id, run_id, after, order):
+        assert thread_id in self.threads
+        return [
+            SimpleNamespace(
+                role='assistant',
+                content=[SimpleNamespace(type='text', text=SimpleNamespace(value=f'{thread_id} {run_id}'))]
+            )
+        ]
+
+    def __init__(self):
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.threads = set()
+        self.active_runs = {}
+        self.beta = SimpleNamespace(
+            threads=SimpleNamespace(
+                create=self.create_thread,
+                delete=self.delete_thread,
+                messages=SimpleNamespace(create=self.create_message, list=self.list_messages),
+                runs=SimpleNamespace(create=self.create_run, retrieve=self.retrieve_run),
+            )
+        )
+
+
+@pytest.fixture(autouse=True)
+def no_polling_delay(monkeypatch):
+    sleep = asyncio.sleep
+    monkeypatch.setattr(interlocutor.asyncio, 'sleep', lambda delay: sleep(0))
+
+
+@pytest.fixture
+def my_interlocutor():
+    my_interlocutor = interlocutor.Interlocutor.__new__(interlocutor.Interlocutor)
+    my_interlocutor.openai = FakeOpenAI()
+    my_interlocutor.assistant_id = 'assistant'
+    my_interlocutor.conversations = {}
+    my_interlocutor.chat_locks = {}
+    my_interlocutor.executor = None
+    return my_interlocutor
+
+
+def test_concurrent_messages_of_one_chat_run_one_at_a_time(my_interlocutor):
+    my_interlocutor.add_conversation(
+        chat_id=1,
+        conversation=interlocutor.conversation.Conversation(
+            thread=my_interlocutor.openai.create_thread(),
+            history_size=interlocutor.DEFAULT_HISTORY_SIZE
+        )
+    )
+
+    async def handle_messages():
+        return await asyncio.gather(*(
+            my_interlocutor.handle_group_message(
+                chat_id=1,
+                conversation=None,
+                message=f'message {index}',
+                user_name='user',
+                group_name='group'
+            )
+            for index in range(5)
+        ))
+
+    responses = asyncio.run(handle_messages())
+    assert len(responses) == 5
+    assert all(len(response) == 1 for response in responses)
+    assert not my_interlocutor.get_conversation(1).has_active_run()
+
+
+def test_concurrent_updates_of_new_chat_create_one_thread(my_interlocutor):
+    async def handle_updates():
+        return await asyncio.gather(*(
+            my_interlocutor.handle_bot_joins_chat(chat_id=1, conversation=None, group_name='group')
+            for _ in range(5)
+        ))
+
+    my_interlocutor.common_phrases = {interlocutor.CommonPhrase.BOT_JOINS_CHAT: 'Hi, {group_name}'}
+    responses = asyncio.run(handle_updates())
+    thread_id = my_interlocutor.get_conversation(1).get_thread_id()
+    assert my_interlocutor.openai.threads == {thread_id}
+    # All the runs have been made on the thread of the conversation
+    assert all(response[0].startswith(f'{thread_id} ') for response in responses)
+
+
+def test_reset_conversation_waits_for_the_run(my_interlocutor):
+    async def handle_message_and_reset():
+        message = asyncio.create_task(
+            my_interlocutor.handle_private_message(chat_id=1, conversation=None, message='hi', user_name='user')
+        )
+        # Let the message create the conversation and start its run
+        while (conversation := my_interlocutor.get_conversation(1)) is None or not conversation.has_active_run():
+            await asyncio.sleep(0)
+        old_thread_id = conversation.get_thread_id()
+        await my_interlocutor.reset_conversation(1)
+        return old_thread_id, await message
+
+    old_thread_id, responses = asyncio.run(handle_message_and_reset())
+    new_thread_id = my_interlocutor.get_conversation(1).get_thread_id()
+    assert new_thread_id != old_thread_id
+    assert my_interlocutor.openai.threads == {new_thread_id}
+    # The run has finished on the old thread before it was deleted
+    assert responses[0].startswith(f'{old_thread_id} ')
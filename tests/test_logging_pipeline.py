@@ -0,0 +1,78 @@
+import contextvars
+import logging
+
+import logging_pipeline
+
+
+def make_record(message: str, *args, sample_key: str = None) -> logging.LogRecord:
+    record = logging.LogRecord('test', logging.DEBUG, __file__, 1, message, args, None)
+    if sample_key is not None:
+        setattr(record, logging_pipeline.SAMPLE_KEY_ATTRIBUTE, sample_key)
+    return record
+
+
+def test_sampling_filter_ignores_records_without_sample_key():
+    sampling_filter = logging_pipeline.SamplingFilter(interval=60)
+    assert all(sampling_filter.filter(make_record('message')) for _ in range(3))
+
+
+def test_sampling_filter_lets_one_record_per_key_through(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(logging_pipeline.time, 'monotonic', lambda: now)
+    sampling_filter = logging_pipeline.SamplingFilter(interval=10)
+    assert sampling_filter.filter(make_record('Run status: %s', 'queued', sample_key='run'))
+    assert not sampling_filter.filter(make_record('Run status: %s', 'queued', sample_key='run'))
+    assert not sampling_filter.filter(make_record('Run status: %s', 'in_progress', sample_key='run'))
+    # The other keys are sampled separately
+    assert sampling_filter.filter(make_record('Run status: %s', 'queued', sample_key='other run'))
+
+
+def test_sampling_filter_counts_suppressed_records(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(logging_pipeline.time, 'monotonic', lambda: now)
+    sampling_filter = logging_pipeline.SamplingFilter(interval=10)
+    sampling_filter.filter(make_record('Run status: %s', 'queued', sample_key='run'))
+    sampling_filter.filter(make_record('Run status: %s', 'queued', sample_key='run'))
+    sampling_filter.filter(make_record('Run status: %s', 'queued', sample_key='run'))
+    now += 10
+    record = make_record('Run status: %s', 'in_progress', sample_key='run')
+    assert sampling_filter.filter(record)
+    assert record.getMessage() == 'Run status: in_progress (2 similar messages suppressed)'
+    # The counter starts over after the suppressed records have been reported
+    now += 10
+    record = make_record('Run status: %s', 'in_progress', sample_key='run')
+    assert sampling_filter.filter(record)
+    assert record.getMessage() == 'Run status: in_progress'
+
+
+def test_truncating_filter_keeps_short_messages():
+    truncating_filter = logging_pipeline.TruncatingFilter(max_length=10)
+    record = make_record('%s', 'x' * 10)
+    assert truncating_filter.filter(record)
+    assert record.getMessage() == 'x' * 10
+
+
+def test_truncating_filter_truncates_long_messages():
+    truncating_filter = logging_pipeline.TruncatingFilter(max_length=10)
+    record = make_record('Prompt: %s', 'x' * 100)
+    assert truncating_filter.filter(record)
+    assert record.getMessage() == 'Prompt: xx... (98 more characters)'
+
+
+def test_correlation_filter_identifies_bot_chat_update_and_run():
+    def log_record():
+        logging_pipeline.reset_correlation(bot='XGameMasterBot', chat_id=10, update_id=20)
+        logging_pipeline.set_correlation(run_id='run_1')
+        record = make_record('message')
+        logging_pipeline.CorrelationFilter().filter(record)
+        return record
+
+    record = contextvars.copy_context().run(log_record)
+    assert (record.bot, record.chat_id, record.update_id, record.run_id) == ('XGameMasterBot', 10, 20, 'run_1')
+    assert record.correlation_id == 'XGameMasterBot/10/20/run_1'
+
+
+def test_correlation_filter_without_correlation():
+    record = make_record('message')
+    contextvars.copy_context().run(logging_pipeline.CorrelationFilter().filter, record)
+    assert record.correlation_id == '-'
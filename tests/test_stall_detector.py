@@ -0,0 +1,73 @@
+import os
+import traceback
+
+import pytest
+
+import stall_detector
+
+
+def make_stack(*frames: tuple[str, int, str]) -> traceback.StackSummary:
+    return traceback.StackSummary.from_list([(filename, lineno, name, '') for filename, lineno, name in frames])
+
+
+def make_detector() -> stall_detector.StallDetector:
+    return stall_detector.StallDetector(threshold=0.1, interval=0.05, report_interval=60)
+
+
+def test_find_location_prefers_project_frames():
+    stack = make_stack(
+        (os.path.join(stall_detector.PROJECT_DIRECTORY, 'interlocutor.py'), 10, 'call_openai'),
+        ('/usr/lib/python3/site-packages/httpx/_client.py', 20, 'send'),
+        ('/usr/lib/python3/socket.py', 30, 'recv'),
+    )
+    assert stall_detector.StallDetector.find_location(stack) == 'interlocutor.py:10 in call_openai'
+
+
+def test_find_location_falls_back_to_innermost_frame():
+    stack = make_stack(('/usr/lib/python3/socket.py', 30, 'recv'))
+    assert stall_detector.StallDetector.find_location(stack) == '/usr/lib/python3/socket.py:30 in recv'
+
+
+def test_is_idle():
+    assert stall_detector.StallDetector.is_idle(make_stack(
+        ('/usr/lib/python3/asyncio/base_events.py', 1, '_run_once'),
+        ('/usr/lib/python3/selectors.py', 2, 'select'),
+    ))
+    assert stall_detector.StallDetector.is_idle(make_stack(
+        ('/usr/lib/python3/asyncio/base_events.py', 1, '_run_once'),
+    ))
+    assert not stall_detector.StallDetector.is_idle(make_stack(
+        ('/usr/lib/python3/asyncio/events.py', 1, '_run'),
+        (os.path.join(stall_detector.PROJECT_DIRECTORY, 'interlocutor.py'), 10, 'call_openai'),
+    ))
+
+
+def test_record_lag_attributes_stalls_to_captured_offender():
+    detector = make_detector()
+    offender = stall_detector.Offender('interlocutor.py:10 in call_openai', '')
+    detector.offenders[offender.get_location()] = offender
+    detector.stalled_by = offender
+    detector.record_lag(0.3)
+    detector.stalled_by = offender
+    detector.record_lag(0.5)
+    assert detector.stalled_by is None
+    assert offender.get_count() == 2
+    assert offender.get_total_lag() == pytest.approx(0.8)
+    assert offender.get_max_lag() == 0.5
+    assert detector.get_statistics() == {'stalls': 2, 'max_lag': 0.5, 'last_lag': 0.5, 'offenders': 1}
+
+
+def test_record_lag_below_threshold_is_not_a_stall():
+    detector = make_detector()
+    offender = stall_detector.Offender('interlocutor.py:10 in call_openai', '')
+    detector.stalled_by = offender
+    detector.record_lag(0.01)
+    assert detector.stalled_by is None
+    assert offender.get_count() == 0
+    assert detector.get_statistics()['stalls'] == 0
+
+
+def test_record_lag_counts_uncaptured_stalls():
+    detector = make_detector()
+    detector.record_lag(0.2)
+    assert detector.get_statistics() == {'stalls': 1, 'max_lag': 0.2, 'last_lag': 0.2, 'offenders': 0}
@@ -0,0 +1,121 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import BadRequest, Forbidden, NetworkError, TimedOut
+from telegram.ext import ApplicationHandlerStop
+
+import telegram_client
+import update_store
+
+
+class StubBot:
+    """Records the sent messages, raises the given errors instead of sending the given texts."""
+
+    async def send_message(self, **kwargs):
+        if (error := self.errors.pop(kwargs['text'].split('\n')[0], None)) is not None:
+            raise error
+        self.sent.append(kwargs)
+
+    def __init__(self, errors: dict = None):
+        self.sent = []
+        self.errors = errors or {}
+
+
+class StubInterlocutor:
+
+    def get_conversation(self, chat_id):
+        return None
+
+
+def make_response(message: str) -> str:
+    return json.dumps({'type': 'message', 'content': {'message': message}})
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = update_store.UpdateStore(str(tmp_path / 'updates.sqlite3'))
+    yield store
+    store.close()
+
+
+def make_client(store: update_store.UpdateStore, bot: StubBot) -> telegram_client.TelegramClient:
+    client = telegram_client.TelegramClient.__new__(telegram_client.TelegramClient)
+    client.interlocutor = StubInterlocutor()
+    client.update_store = store
+    client.executor = None
+    client.name = 'TestBot'
+    client.application = SimpleNamespace(bot=bot)
+    return client
+
+
+def make_update(update_id: int, chat_id: int = 10):
+    return SimpleNamespace(update_id=update_id, effective_chat=SimpleNamespace(id=chat_id))
+
+
+def sent_texts(bot: StubBot) -> list[str]:
+    return [message['text'].split('\n')[0] for message in bot.sent]
+
+
+def test_skip_processed_updates_stops_redelivered_update(store):
+    client = make_client(store, StubBot())
+    store.add_pending_reply(update_id=1, chat_id=10, responses=[])
+    with pytest.raises(ApplicationHandlerStop):
+        asyncio.run(client.skip_processed_updates(make_update(1), None))
+    # A new update goes further
+    asyncio.run(client.skip_processed_updates(make_update(2), None))
+
+
+def test_process_responses_delivers_and_forgets_reply(store):
+    bot = StubBot()
+    client = make_client(store, bot)
+    asyncio.run(client.process_responses(make_update(1), [make_response('a'), make_response('b')], 5))
+    assert sent_texts(bot) == ['a', 'b']
+    assert all(message['reply_to_message_id'] == 5 for message in bot.sent)
+    assert all(message['allow_sending_without_reply'] for message in bot.sent)
+    assert store.is_processed(1)
+    assert store.get_pending_replies() == []
+
+
+def test_deliver_responses_resumes_from_delivered(store):
+    bot = StubBot()
+    client = make_client(store, bot)
+    pending_reply = store.add_pending_reply(
+        update_id=1,
+        chat_id=10,
+        responses=[make_response('a'), make_response('b'), make_response('c')]
+    )
+    store.set_delivered(pending_reply, 1)
+    [pending_reply] = store.get_pending_replies()
+    asyncio.run(client.deliver_responses(pending_reply))
+    assert sent_texts(bot) == ['b', 'c']
+    assert all(message['chat_id'] == 10 for message in bot.sent)
+    assert store.get_pending_replies() == []
+
+
+@pytest.mark.parametrize('error', [Forbidden('blocked'), BadRequest('message to be replied not found')])
+def test_resume_pending_replies_drops_reply_on_permanent_error(store, error):
+    bot = StubBot(errors={'b': error})
+    client = make_client(store, bot)
+    store.add_pending_reply(update_id=1, chat_id=10, responses=[make_response('a'), make_response('b')])
+    store.add_pending_reply(update_id=2, chat_id=20, responses=[make_response('c')])
+    asyncio.run(client.resume_pending_replies(None))
+    # The other replies are resumed anyway
+    assert sent_texts(bot) == ['a', 'c']
+    assert store.get_pending_replies() == []
+
+
+@pytest.mark.parametrize('error', [NetworkError('connection reset'), TimedOut()])
+def test_resume_pending_replies_keeps_reply_on_transient_error(store, error):
+    bot = StubBot(errors={'b': error})
+    client = make_client(store, bot)
+    store.add_pending_reply(update_id=1, chat_id=10, responses=[make_response('a'), make_response('b')])
+    asyncio.run(client.resume_pending_replies(None))
+    assert sent_texts(bot) == ['a']
+    [pending_reply] = store.get_pending_replies()
+    assert pending_reply.get_delivered() == 1
+    # The next start sends only what hasn't been delivered yet
+    asyncio.run(client.resume_pending_replies(None))
+    assert sent_texts(bot) == ['a', 'b']
+    assert store.get_pending_replies() == []
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+import update_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = update_store.UpdateStore(str(tmp_path / 'var' / 'updates.sqlite3'))
+    yield store
+    store.close()
+
+
+def test_add_pending_reply_marks_update_processed(store):
+    assert not store.is_processed(1)
+    pending_reply = store.add_pending_reply(update_id=1, chat_id=10, responses=['a', 'b'], reply_to_message=5)
+    assert store.is_processed(1)
+    assert not store.is_processed(2)
+    assert pending_reply.get_delivered() == 0
+    assert pending_reply.get_undelivered_responses() == ['a', 'b']
+
+
+def test_set_delivered_is_persisted(store):
+    pending_reply = store.add_pending_reply(update_id=1, chat_id=10, responses=['a', 'b', 'c'], reply_to_message=5)
+    store.set_delivered(pending_reply, 2)
+    assert pending_reply.get_undelivered_responses() == ['c']
+    [stored_reply] = store.get_pending_replies()
+    assert stored_reply.get_id() == pending_reply.get_id()
+    assert stored_reply.get_update_id() == 1
+    assert stored_reply.get_chat_id() == 10
+    assert stored_reply.get_reply_to_message() == 5
+    assert stored_reply.get_delivered() == 2
+    assert stored_reply.get_undelivered_responses() == ['c']
+
+
+def test_pending_replies_survive_reopening(tmp_path):
+    path = str(tmp_path / 'updates.sqlite3')
+    store = update_store.UpdateStore(path)
+    store.add_pending_reply(update_id=1, chat_id=10, responses=['a'])
+    store.close()
+    store = update_store.UpdateStore(path)
+    assert store.is_processed(1)
+    assert [pending_reply.get_responses() for pending_reply in store.get_pending_replies()] == [['a']]
+    store.close()
+
+
+def test_remove_pending_reply_keeps_update_processed(store):
+    pending_reply = store.add_pending_reply(update_id=1, chat_id=10, responses=['a'])
+    store.remove_pending_reply(pending_reply)
+    assert store.get_pending_replies() == []
+    assert store.is_processed(1)
+
+
+def test_forget_expired_updates(store, monkeypatch):
+    store.add_pending_reply(update_id=1, chat_id=10, responses=['a'])
+    now = time.time()
+    monkeypatch.setattr(update_store.time, 'time', lambda: now + update_store.PROCESSED_UPDATES_TTL + 1)
+    store.add_pending_reply(update_id=2, chat_id=10, responses=['b'])
+    store.forget_expired_updates()
+    assert not store.is_processed(1)
+    assert store.is_processed(2)
+
+
+def test_add_pending_reply_forgets_expired_updates_periodically(store, monkeypatch):
+    store.add_pending_reply(update_id=1, chat_id=10, responses=['a'])
+    now = time.time()
+    monkeypatch.setattr(update_store.time, 'time', lambda: now + update_store.PROCESSED_UPDATES_TTL + 1)
+    store.add_pending_reply(update_id=2, chat_id=10, responses=['b'])
+    # The purge interval hasn't passed yet
+    assert store.is_processed(1)
+    store.last_purge -= update_store.PURGE_INTERVAL
+    store.add_pending_reply(update_id=3, chat_id=10, responses=['c'])
+    assert not store.is_processed(1)
+    assert store.is_processed(2)
+    assert store.is_processed(3)
@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from config import PROJECT_NAME
+
+
+# Telegram keeps unconfirmed updates for 24 hours, so there's no point in
+# remembering processed updates for longer than that.
+PROCESSED_UPDATES_TTL = 24 * 60 * 60
+
+# How often the expired processed updates are forgotten
+PURGE_INTERVAL = 60 * 60
+
+
+logger = logging.getLogger(f'{PROJECT_NAME}.{__name__}')
+
+
+class PendingReply:
+
+    def get_id(self) -> int:
+        return self.pending_reply_id
+
+    def get_chat_id(self) -> int:
+        return self.chat_id
+
+    def get_update_id(self) -> int:
+        return self.update_id
+
+    def get_responses(self) -> list[str]:
+        return self.responses
+
+    def get_delivered(self) -> int:
+        return self.delivered
+
+    def get_reply_to_message(self) -> Optional[int]:
+        return self.reply_to_message
+
+    def get_undelivered_responses(self) -> list[str]:
+        return self.responses[self.delivered:]
+
+    def __init__(
+            self,
+            pending_reply_id: int,
+            update_id: int,
+            chat_id: int,
+            responses: list[str],
+            delivered: int = 0,
+            reply_to_message: Optional[int] = None
+    ) -> None:
+        self.pending_reply_id = pending_reply_id
+        self.update_id = update_id
+        self.chat_id = chat_id
+        self.responses = responses
+        self.delivered = delivered
+        self.reply_to_message = reply_to_message
+
+
+class UpdateStore:
+    """
+    Local persistent store of the updates that have already been processed
+    and of the replies that have been generated but not delivered yet.
+
+    When the bot crashes or restarts, Telegram redelivers the updates that
+    haven't been confirmed. The store lets us recognize such updates (so the
+    assistant isn't called twice for the same message) and resume sending the
+    replies that were generated before the crash.
+
+    The methods are blocking, so they're meant to be run in an executor.
+    """
+
+    def is_processed(self, update_id: int) -> bool:
+        with self.lock:
+            cursor = self.connection.execute(
+                'SELECT 1 FROM processed_updates WHERE update_id = ?',
+                (update_id,)
+            )
+            return cursor.fetchone() is not None
+
+    def add_pending_reply(
+            self,
+            update_id: int,
+            chat_id: int,
+            responses: list[str],
+            reply_to_message: Optional[int] = None
+    ) -> PendingReply:
+        """
+        Stores the generated replies and marks the update as processed, both in
+        the same transaction, so a redelivered update is never answered twice.
+        """
+        if time.monotonic() - self.last_purge >= PURGE_INTERVAL:
+            self.forget_expired_updates()
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO processed_updates (update_id, chat_id, processed_at) VALUES (?, ?, ?)',
+                (update_id, chat_id, int(time.time()))
+            )
+            cursor = self.connection.execute(
+                'INSERT INTO pending_replies (update_id, chat_id, reply_to_message, responses, delivered) '
+                'VALUES (?, ?, ?, ?, 0)',
+                (update_id, chat_id, reply_to_message, json.dumps(responses))
+            )
+        return PendingReply(
+            pending_reply_id=cursor.lastrowid,
+            update_id=update_id,
+            chat_id=chat_id,
+            responses=responses,
+            reply_to_message=reply_to_message
+        )
+
+    def set_delivered(self, pending_reply: PendingReply, delivered: int) -> None:
+        pending_reply.delivered = delivered
+        with self.lock, self.connection:
+            self.connection.execute(
+                'UPDATE pending_replies SET delivered = ? WHERE id = ?',
+                (delivered, pending_reply.get_id())
+            )
+
+    def remove_pending_reply(self, pending_reply: PendingReply) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                'DELETE FROM pending_replies WHERE id = ?',
+                (pending_reply.get_id(),)
+            )
+
+    def get_pending_replies(self) -> list[PendingReply]:
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT id, update_id, chat_id, reply_to_message, responses, delivered '
+                'FROM pending_replies ORDER BY chat_id, id'
+            ).fetchall()
+        return [
+            PendingReply(
+                pending_reply_id=row[0],
+                update_id=row[1],
+                chat_id=row[2],
+                reply_to_message=row[3],
+                responses=json.loads(row[4]),
+                delivered=row[5]
+            )
+            for row in rows
+        ]
+
+    def forget_expired_updates(self) -> None:
+        self.last_purge = time.monotonic()
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                'DELETE FROM processed_updates WHERE processed_at < ?',
+                (int(time.time()) - PROCESSED_UPDATES_TTL,)
+            )
+        if cursor.rowcount > 0:
+            logger.debug('Forgot %d expired processed updates', cursor.rowcount)
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        if (directory := os.path.dirname(path)) != '':
+            os.makedirs(directory, exist_ok=True)
+        # The store is used from the executor's threads, one at a time
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # The write-ahead log doesn't need to sync on every commit, a commit
+        # may be lost on a power failure, but the database stays consistent
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS processed_updates ('
+                'update_id INTEGER PRIMARY KEY, '
+                'chat_id INTEGER, '
+                'processed_at INTEGER NOT NULL'
+                ')'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS pending_replies ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'update_id INTEGER NOT NULL, '
+                'chat_id INTEGER NOT NULL, '
+                'reply_to_message INTEGER, '
+                'responses TEXT NOT NULL, '
+                'delivered INTEGER NOT NULL DEFAULT 0'
+                ')'
+            )
+        self.forget_expired_updates()